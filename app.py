@@ -4,6 +4,14 @@ import numpy as np
 import re
 import io
 import os
+import xlsxwriter
+
+# 엑셀 읽기 엔진: calamine(Rust)이 없으면 openpyxl로 대체
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
 
 # --------------------------------------------------------------------------
 # [설정] 페이지 기본
@@ -11,117 +19,458 @@ import os
 st.set_page_config(page_title="도시가스 경제성 분석기", layout="wide")
 
 DEFAULT_FILE_NAME = "리스트_20260129.xlsx"
+# 숫자 추출 패턴 (parse_series의 str.extract용 컴파일 객체)
+_NUM_RE = re.compile(r"([-+]?\d*\.\d+|\d+)")
+# 컬럼명에서 제거할 공백 문자 (줄바꿈/공백/탭)
+_COL_TBL = str.maketrans('', '', '\n \t')
+
+# 역할별 컬럼 키워드 (계산 / 산출 근거 / 그래프 공통)
+COL_KEYWORDS = {
+    "inv": ["배관투자", "투자금액"],
+    "contrib": ["시설분담금", "분담금"],
+    "vol": ["연간판매량", "판매량계"],
+    "profit": ["연간판매수익", "판매수익"],
+    "len": ["길이", "연장"],
+    "hh": ["계획전수", "전수", "세대수"],
+    "usage": ["용도", "구분"],
+}
+NUMERIC_ROLES = ["inv", "contrib", "vol", "profit", "len", "hh"]
+# 화면 구성용 컬럼 키워드 (프로젝트 선택 / 연도 추출 / 용도별 그래프)
+PAGE_COL_KEYWORDS = {
+    "name": ["투자분석명", "공사명"],
+    "id": ["공사관리번호", "관리번호"],
+    "usage": COL_KEYWORDS["usage"],
+}
+RESIDENTIAL_KEYWORDS = ['공동', '단독', '주택', '아파트']
+_RESIDENTIAL_RE = "|".join(map(re.escape, RESIDENTIAL_KEYWORDS))
+
+# 이 행 수를 넘으면 Styler 그라데이션 대신 클라이언트 렌더링(column_config) 사용
+STYLER_MAX_ROWS = 500
+# 이 행 수를 넘으면 CSV 다운로드를 권장하는 안내 표시
+EXCEL_MAX_ROWS = 50_000
+# 그래프 대상 연도 (공사관리번호 앞 4자리 기준)
+CHART_YEARS = range(2020, 2025)
+
+# --------------------------------------------------------------------------
+# [함수] 데이터 로드
+# --------------------------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def load_excel(source, mtime=None):
+    """엑셀 읽기 + 컬럼명 정규화 캐시 (파일은 경로+수정시각, 업로드는 바이트 내용이 키)"""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return clean_column_names(pd.read_excel(source, engine=EXCEL_ENGINE))
 
 # --------------------------------------------------------------------------
 # [함수] 데이터 전처리 & 파싱
 # --------------------------------------------------------------------------
 def clean_column_names(df):
     """컬럼명 정규화"""
-    df.columns = [str(c).replace("\n", "").replace(" ", "").replace("\t", "").strip() for c in df.columns]
+    df.columns = [str(c).translate(_COL_TBL).strip() for c in df.columns]
     return df
 
-def find_col(df, keywords):
+def build_col_index(df, keyword_groups):
+    """컬럼을 한 번만 훑어 {역할: 컬럼명} 매핑 생성 (역할마다 키워드가 포함된 첫 컬럼)"""
+    index = dict.fromkeys(keyword_groups)
+    pending = dict(keyword_groups)
     for col in df.columns:
-        for kw in keywords:
-            if kw in col:
-                return col
-    return None
-
-def parse_value(value):
-    try:
-        if pd.isna(value) or value == '':
-            return 0.0
-        clean_str = str(value).replace(',', '')
-        numbers = re.findall(r"[-+]?\d*\.\d+|\d+", clean_str)
-        if numbers:
-            return float(numbers[0])
-        return 0.0
-    except:
-        return 0.0
+        for role, keywords in list(pending.items()):
+            if any(kw in col for kw in keywords):
+                index[role] = col
+                del pending[role]
+        if not pending:
+            break
+    return index
+
+def parse_series(series):
+    """컬럼 단위 숫자 변환 (정규식은 직접 변환이 안 되는 셀에만 적용)"""
+    if pd.api.types.is_numeric_dtype(series):
+        return pd.to_numeric(series, errors='coerce').fillna(0.0).to_numpy(dtype=np.float64)
+    text = series.astype(str).str.replace(',', '', regex=False)
+    numbers = pd.to_numeric(text, errors='coerce').astype(np.float64)
+    fallback = ~np.isfinite(numbers)
+    if fallback.any():
+        extracted = text[fallback].str.extract(_NUM_RE, expand=False)
+        numbers[fallback] = pd.to_numeric(extracted, errors='coerce')
+    return numbers.fillna(0.0).to_numpy(dtype=np.float64)
+
+def extract_arrays(df):
+    """역할별 컬럼을 한 번만 찾아 NumPy 배열로 변환"""
+    cols = build_col_index(df, COL_KEYWORDS)
+    arrays = {}
+    for role in NUMERIC_ROLES:
+        col = cols[role]
+        if col:
+            arrays[role] = parse_series(df[col])
+        else:
+            arrays[role] = np.zeros(len(df))
+    if cols["usage"]:
+        arrays["usage"] = df[cols["usage"]].fillna("").astype(str).to_numpy(dtype=object)
+    else:
+        arrays["usage"] = np.full(len(df), "", dtype=object)
+    return cols, arrays
 
 # --------------------------------------------------------------------------
 # [함수] 엑셀형 단순 연금 계산 로직
 # --------------------------------------------------------------------------
-def calculate_all_rows(df, target_irr, tax_rate, period, cost_maint_m, cost_admin_hh, cost_admin_m, margin_override=None):
+def annuity_factors(target_irr, tax_rate, period):
+    """PVIFA와 역수 상수 (일괄 계산과 산출 근거가 같은 값을 쓰도록 공유)"""
     if target_irr == 0:
         pvifa = period
     else:
         pvifa = (1 - (1 + target_irr) ** (-period)) / target_irr
+    return pvifa, 1.0 / pvifa, 1.0 / (1 - tax_rate), 1.0 / period
 
-    results = []
-    margin_debug = [] 
-    
-    col_invest = find_col(df, ["배관투자", "투자금액"])
-    col_contrib = find_col(df, ["시설분담금", "분담금"])
-    col_vol = find_col(df, ["연간판매량", "판매량계"])
-    col_profit = find_col(df, ["연간판매수익", "판매수익"])
-    col_len = find_col(df, ["길이", "연장"])
-    col_hh = find_col(df, ["계획전수", "전수", "세대수"])
-    col_usage = find_col(df, ["용도", "구분"])
-
-    if not col_invest or not col_vol or not col_profit:
-        return df, [], "❌ 핵심 컬럼 미발견"
-
-    for index, row in df.iterrows():
-        try:
-            investment = parse_value(row.get(col_invest))
-            contribution = parse_value(row.get(col_contrib))
-            current_vol = parse_value(row.get(col_vol))
-            current_profit = parse_value(row.get(col_profit))
-            length = parse_value(row.get(col_len))
-            households = parse_value(row.get(col_hh))
-            usage_str = row.get(col_usage, "")
-
-            if current_vol <= 0 or investment <= 0:
-                results.append(0)
-                margin_debug.append(0)
-                continue
-
-            net_investment = investment - contribution
-            if net_investment <= 0:
-                required_capital_recovery = 0
-            else:
-                required_capital_recovery = net_investment / pvifa
+def required_volumes(arrays, inv_pvifa, inv_tax, inv_period, cost_maint_m, cost_admin_hh, cost_admin_m, margin_override=None):
+    """최소 판매량 계산 커널 (상수 자리에 배열을 넘기면 시나리오 축으로 브로드캐스트)"""
+    investment = arrays["inv"]
+    contribution = arrays["contrib"]
+    current_vol = arrays["vol"]
+    current_profit = arrays["profit"]
+    length = arrays["len"]
+    households = arrays["hh"]
 
-            maint_cost = length * cost_maint_m
-            if any(k in str(usage_str) for k in ['공동', '단독', '주택', '아파트']):
-                admin_cost = households * cost_admin_hh
-            else:
-                admin_cost = length * cost_admin_m
-            total_sga = maint_cost + admin_cost
-            
-            depreciation = investment / period
-            required_ebit = (required_capital_recovery - depreciation) / (1 - tax_rate)
-            required_gross_margin = required_ebit + total_sga + depreciation
-            
-            calculated_margin = current_profit / current_vol
-            if margin_override and margin_override > 0:
-                final_margin = margin_override
-            else:
-                final_margin = calculated_margin
+    # 행 단위 루프 대신 컬럼 전체를 한 번에 계산 (0 나누기 등은 아래 마스크로 제외)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        net_investment = investment - contribution
+        required_capital_recovery = np.where(net_investment > 0, net_investment * inv_pvifa, 0.0)
+
+        maint_cost = length * cost_maint_m
+        admin_cost = np.where(arrays["is_residential"], households * cost_admin_hh, length * cost_admin_m)
+        total_sga = maint_cost + admin_cost
+
+        depreciation = investment * inv_period
+        required_ebit = (required_capital_recovery - depreciation) * inv_tax
+        required_gross_margin = required_ebit + total_sga + depreciation
+
+        if margin_override and margin_override > 0:
+            final_margin = np.full_like(current_vol, float(margin_override))
+        else:
+            final_margin = current_profit / current_vol
 
-            if final_margin <= 0:
-                results.append(0)
-                margin_debug.append(0)
-                continue
+        required_volume = required_gross_margin / final_margin
 
-            required_volume = required_gross_margin / final_margin
-            results.append(max(0, required_volume))
-            margin_debug.append(final_margin)
+    valid = (current_vol > 0) & (investment > 0) & (final_margin > 0)
+    return required_volume, final_margin, valid
+
+def calculate_all_rows(df, target_irr, tax_rate, period, cost_maint_m, cost_admin_hh, cost_admin_m, margin_override=None):
+    try:
+        pvifa, inv_pvifa, inv_tax, inv_period = annuity_factors(target_irr, tax_rate, period)
+    except ZeroDivisionError:
+        return df, {}, "❌ 상각 기간 0년 또는 세율 100%로는 계산할 수 없습니다"
 
-        except:
-            results.append(0)
-            margin_debug.append(0)
+    cols, arrays = extract_arrays(df)
+    if not cols["inv"] or not cols["vol"] or not cols["profit"]:
+        return df, {}, "❌ 핵심 컬럼 미발견"
+
+    current_vol = arrays["vol"]
+
+    # 주택용 여부 (관리비를 전수 기준으로 산정)
+    arrays["is_residential"] = pd.Series(arrays["usage"]).str.contains(_RESIDENTIAL_RE, regex=True, na=False).to_numpy()
+
+    required_volume, final_margin, valid = required_volumes(
+        arrays, inv_pvifa, inv_tax, inv_period,
+        cost_maint_m, cost_admin_hh, cost_admin_m, margin_override
+    )
+    finite = np.isfinite(required_volume)
+    # 0으로 처리되는 행과 사유 기록 (엑셀 행 번호 = 위치 + 헤더 1행 + 1)
+    no_vol = ~(current_vol > 0)
+    reasons = [
+        ("투자비 ≤ 0", ~(arrays["inv"] > 0)),
+        ("판매량 ≤ 0", no_vol),
+        ("마진 ≤ 0", ~(final_margin > 0) & ~no_vol),
+        ("비정상 판매량", valid & ~finite),
+    ]
+    calc_warnings = [
+        f"엑셀 {pos + 2}행: {', '.join(label for label, bad in reasons if bad[pos])} → 0 처리"
+        for pos in np.flatnonzero(~(valid & finite))
+    ]
+    valid &= finite
+
+    results = np.where(valid, np.maximum(required_volume, 0), 0.0)
+    margin_debug = np.where(valid, final_margin, 0.0)
     
     df['최소경제성만족판매량'] = results
     df['적용마진(원)'] = margin_debug
     
-    df['달성률'] = df.apply(
-        lambda x: (x[col_vol] / x['최소경제성만족판매량'] * 100) if x['최소경제성만족판매량'] > 1 else (999.9 if x[col_vol] > 0 else 0), 
-        axis=1
+    # 달성률: 최소 판매량이 1 이하이면 판매량 유무에 따라 999.9 / 0
+    safe_required = np.where(results > 1, results, 1.0)
+    achievement = np.where(
+        results > 1,
+        current_vol / safe_required * 100,
+        np.where(current_vol > 0, 999.9, 0.0)
+    )
+    df['달성률'] = achievement
+    df.attrs['calc_warnings'] = calc_warnings
+
+    return df, arrays, None
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def sensitivity_table(arrays, irr_values, tax_values, period, cost_maint_m, cost_admin_hh, cost_admin_m, margin_override=None):
+    """목표 IRR × 세율 시나리오별 최소 판매량 합계 (전 시나리오를 한 번의 배열 연산으로)"""
+    inv_pvifa = np.array([annuity_factors(irr, 0.0, period)[1] for irr in irr_values])[:, None, None]
+    inv_tax = (1.0 / (1.0 - np.asarray(tax_values, dtype=np.float64)))[None, :, None]
+    required_volume, _, valid = required_volumes(
+        arrays, inv_pvifa, inv_tax, 1.0 / period,
+        cost_maint_m, cost_admin_hh, cost_admin_m, margin_override
+    )
+    valid = valid & np.isfinite(required_volume)
+    totals = np.where(valid, np.maximum(required_volume, 0), 0.0).sum(axis=-1)
+    return pd.DataFrame(
+        totals,
+        index=pd.Index([round(irr * 100, 2) for irr in irr_values], name="목표 IRR (%)"),
+        columns=pd.Index([round(tax * 100, 1) for tax in tax_values], name="세율 (%)"),
     )
 
-    return df, results, None
+@st.cache_data(show_spinner=False)
+def calculate_all_rows_cached(df, target_irr, tax_rate, period, cost_maint_m, cost_admin_hh, cost_admin_m, margin_override=None):
+    """입력값이 같으면 이전 계산 결과 재사용 (원본 df는 보존)"""
+    return calculate_all_rows(
+        df.copy(), target_irr, tax_rate, period,
+        cost_maint_m, cost_admin_hh, cost_admin_m, margin_override
+    )
+
+# --------------------------------------------------------------------------
+# [함수] 엑셀/CSV 내보내기
+# --------------------------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def _to_csv(df):
+    """데이터프레임 → CSV 바이트 (재실행 시 재직렬화 방지)"""
+    # 중간 str 생성 없이 BytesIO에 바로 인코딩
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding='utf-8-sig')
+    return buf.getvalue()
+
+@st.cache_data(show_spinner=False)
+def to_excel_bytes(df):
+    """결과표 → xlsx 바이트 (constant_memory 스트리밍)"""
+    # constant_memory는 행 순서 기록만 지원 → 열 단위로 쓰는 to_excel 대신 write_row
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+    worksheet = workbook.add_worksheet('Sheet1')
+    worksheet.set_column('A:Z', 18)
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+
+    # 날짜 컬럼은 날짜만, 시각이 있는 컬럼만 시:분:초까지 표시
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    time_cols = [
+        i for i, (_, col) in enumerate(df.items())
+        if pd.api.types.is_datetime64_any_dtype(col) and (col.dropna() != col.dropna().dt.normalize()).any()
+    ]
+
+    # 결측(NaN/NaT)은 행 단위로 빈 셀 처리 (전체 object 사본을 만들지 않음)
+    for r, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        cells = [None if pd.isna(v) else v for v in row]
+        worksheet.write_row(r, 0, cells)
+        for c in time_cols:
+            if cells[c] is not None:
+                worksheet.write_datetime(r, c, cells[c], datetime_format)
+    workbook.close()
+    return output.getvalue()
+
+# --------------------------------------------------------------------------
+# [UI] 개별 프로젝트 산출 근거 (fragment: 프로젝트 선택 시 결과표 재렌더링 없음)
+# --------------------------------------------------------------------------
+@st.fragment
+def render_project_detail(row_index, arrays, target_irr, tax_rate, period, cost_maint_m, cost_admin_hh, cost_admin_m, margin_override):
+    selected = st.selectbox("프로젝트 선택:", list(row_index))
+    i = row_index[selected]
+
+    # 계산 단계에서 변환해 둔 배열을 그대로 재사용
+    inv = arrays["inv"][i]
+    cont = arrays["contrib"][i]
+    vol = arrays["vol"][i]
+    profit = arrays["profit"][i]
+    length = arrays["len"][i]
+    hh = arrays["hh"][i]
+
+    pvifa, inv_pvifa, inv_tax, inv_period = annuity_factors(target_irr, tax_rate, period)
+    net_inv = inv - cont
+    req_capital = max(0, net_inv * inv_pvifa)
+
+    maint_c = length * cost_maint_m
+    if arrays["is_residential"][i]:
+        admin_c = hh * cost_admin_hh
+        note = "주택용"
+    else:
+        admin_c = length * cost_admin_m
+        note = "비주택"
+    total_sga = maint_c + admin_c
+
+    dep = inv * inv_period
+    req_ebit = (req_capital - dep) * inv_tax
+    req_gross = req_ebit + total_sga + dep
+
+    auto_margin = profit / vol if vol > 0 else 0
+    if margin_override > 0:
+        final_margin = margin_override
+    else:
+        final_margin = auto_margin
+
+    final_vol = req_gross / final_margin if final_margin > 0 else 0
+
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("**1. 투자 정보**")
+        st.write(f"- 순투자액: **{net_inv:,.0f}** 원")
+        st.write(f"- 운영 비용: {total_sga:,.0f} 원")
+    with c2:
+        st.markdown("**2. 수익 구조**")
+        st.info(f"👉 **적용 마진:** {final_margin:.4f} 원/MJ")
+
+    st.markdown("---")
+    if final_vol > 0:
+        verify_margin = final_vol * final_margin
+        verify_ocf = (verify_margin - total_sga - dep) * (1 - tax_rate) + dep
+        verify_npv = (verify_ocf * pvifa) - net_inv
+
+        st.write(f"**[최종 결과]** 목표 달성 최소 판매량: **{final_vol:,.1f} MJ**")
+        if abs(verify_npv) < 1000:
+            st.success("✅ NPV ≈ 0 검증 완료")
+        else:
+            st.warning("⚠️ 미세 오차 발생")
+
+# --------------------------------------------------------------------------
+# [UI] 그래프 리포트 (fragment: 탭/용도 선택 시 이 영역만 재실행)
+# --------------------------------------------------------------------------
+def annual_volume_pivot(chart_df, col_use):
+    """연도 × 용도별 최소 판매량 합계 (그래프 탭 4개가 이 표 하나를 잘라 씀)"""
+    if col_use:
+        grouped = chart_df.groupby(['년도', col_use], dropna=False)['최소경제성만족판매량'].sum()
+        return grouped.unstack(fill_value=0)
+    return chart_df.groupby('년도')['최소경제성만족판매량'].sum().to_frame()
+
+@st.fragment
+def render_charts(pivot, has_usage):
+    st.divider()
+    st.header("📉 경제성 분석 리포트 (Visual Analytics)")
+
+    total_by_year = pivot.sum(axis=1)
+
+    # 3-1. 연도별 분석 리포트
+    st.subheader("1. 연도별 최소 판매량 추이 (Annual)")
+
+    tab1, tab2 = st.tabs(["📊 전체 추이 (막대)", "📈 용도별 상세 (선형)"])
+
+    # Tab 1: 전체
+    with tab1:
+        st.bar_chart(total_by_year, color="#FF6C6C")
+
+        display_df = pd.DataFrame(total_by_year).reset_index()
+        display_df.columns = ['Year', 'Total Volume (MJ)']
+        st.dataframe(display_df.style.format({"Total Volume (MJ)": "{:,.0f}"}), hide_index=True)
+
+        # [추가] 다운로드 버튼 (CSV)
+        csv = _to_csv(display_df)
+        st.download_button("📥 데이터 다운로드 (CSV)", csv, "annual_total.csv", "text/csv")
+
+    # Tab 2: 용도별
+    with tab2:
+        if has_usage:
+            usage_list = sorted(pivot.columns.tolist())
+            usage_list.insert(0, "전체 합계 (Total)")
+
+            selected_usage = st.selectbox("분석할 용도 선택:", usage_list, key="annual_usage")
+
+            if selected_usage == "전체 합계 (Total)":
+                usage_by_year = total_by_year
+                chart_color = "#FF4B4B"
+            else:
+                usage_by_year = pivot[selected_usage]
+                chart_color = "#FFA500"
+
+            usage_by_year = usage_by_year.reindex(CHART_YEARS, fill_value=0)
+            st.line_chart(usage_by_year, color=chart_color)
+
+            display_df = pd.DataFrame(usage_by_year).reset_index()
+            display_df.columns = ['Year', 'Volume (MJ)']
+            st.dataframe(display_df.style.format({"Volume (MJ)": "{:,.0f}"}), hide_index=True)
+
+            # [추가] 다운로드 버튼 (CSV)
+            csv_usg = _to_csv(display_df)
+            st.download_button(f"📥 {selected_usage} 데이터 다운로드 (CSV)", csv_usg, f"annual_{selected_usage}.csv", "text/csv")
+        else:
+            st.warning("용도 컬럼 없음")
+
+    # 3-2. 누적 분석 리포트
+    st.divider()
+    st.subheader("2. 연도별 누적 최소 판매량 (Cumulative)")
+
+    tab_cum1, tab_cum2 = st.tabs(["📊 전체 누적 (막대)", "📈 용도별 누적 (선형)"])
+
+    # Tab 1: 전체 누적
+    with tab_cum1:
+        cumulative_sum = total_by_year.reindex(CHART_YEARS, fill_value=0).cumsum()
+
+        st.bar_chart(cumulative_sum, color="#4CAF50")
+
+        cum_df = pd.DataFrame({
+            "연도": cumulative_sum.index,
+            "누적 판매량 (MJ)": cumulative_sum.values
+        })
+        st.dataframe(cum_df.style.format({"누적 판매량 (MJ)": "{:,.0f}"}), hide_index=True)
+
+        # [추가] 다운로드 버튼
+        csv_cum = _to_csv(cum_df)
+        st.download_button("📥 누적 데이터 다운로드 (CSV)", csv_cum, "cumulative_total.csv", "text/csv")
+
+    # Tab 2: 용도별 누적
+    with tab_cum2:
+        if has_usage:
+            usage_list_cum = sorted(pivot.columns.tolist())
+            usage_list_cum.insert(0, "전체 합계 (Total)")
+
+            selected_usage_cum = st.selectbox("누적 분석할 용도 선택:", usage_list_cum, key="cum_usage")
+
+            if selected_usage_cum == "전체 합계 (Total)":
+                annual_data = total_by_year
+                chart_color_cum = "#2E7D32" 
+            else:
+                annual_data = pivot[selected_usage_cum]
+                chart_color_cum = "#009688"
+
+            annual_data = annual_data.reindex(CHART_YEARS, fill_value=0)
+            cumulative_data = annual_data.cumsum()
+
+            st.line_chart(cumulative_data, color=chart_color_cum)
+
+            cum_disp_df = pd.DataFrame(cumulative_data).reset_index()
+            cum_disp_df.columns = ['Year', 'Cumulative Volume (MJ)']
+            st.dataframe(cum_disp_df.style.format({"Cumulative Volume (MJ)": "{:,.0f}"}), hide_index=True)
+
+            # [추가] 다운로드 버튼
+            csv_cum_usg = _to_csv(cum_disp_df)
+            st.download_button(f"📥 {selected_usage_cum} 누적 데이터 다운로드 (CSV)", csv_cum_usg, f"cumulative_{selected_usage_cum}.csv", "text/csv")
+
+# --------------------------------------------------------------------------
+# [UI] 민감도 분석 (fragment: 실행 버튼은 이 영역만 재실행)
+# --------------------------------------------------------------------------
+@st.fragment
+def render_sensitivity(arrays, target_irr, tax_rate, period, cost_maint_m, cost_admin_hh, cost_admin_m, margin_override):
+    st.divider()
+    st.header("🎛️ 민감도 분석 (목표 IRR × 세율)")
+    st.caption("현재 기준 주변 시나리오별 최소경제성만족판매량 합계 (MJ)")
+
+    if st.button("▶ 민감도 분석 실행"):
+        irr_offsets = (-0.02, -0.01, 0.0, 0.01, 0.02)
+        tax_offsets = (-0.05, 0.0, 0.05)
+        irr_values = [irr for irr in (target_irr + d for d in irr_offsets) if irr >= 0]
+        tax_values = [tax for tax in (tax_rate + d for d in tax_offsets) if 0 <= tax < 1]
+        if not irr_values or not tax_values:
+            st.info("계산 가능한 시나리오가 없습니다 (목표 IRR ≥ 0%, 세율 0~100% 미만 필요)")
+            return
+        if len(irr_values) < len(irr_offsets) or len(tax_values) < len(tax_offsets):
+            st.caption("* 범위를 벗어난 시나리오(목표 IRR < 0%, 세율 0~100% 밖)는 제외됨")
+
+        # 캐시 키는 숫자/불리언 배열만 (object 배열은 포인터 바이트로 해시되어 매번 키가 바뀜)
+        kernel_arrays = {role: arrays[role] for role in NUMERIC_ROLES + ["is_residential"]}
+        with st.spinner("계산 중…"):
+            table = sensitivity_table(
+                kernel_arrays, irr_values, tax_values, period,
+                cost_maint_m, cost_admin_hh, cost_admin_m, margin_override
+            )
+        st.dataframe(table.style.background_gradient(cmap="Oranges", axis=None).format("{:,.0f}"))
 
 # --------------------------------------------------------------------------
 # [UI] 사이드바
@@ -133,20 +482,23 @@ with st.sidebar:
         uploaded_file = st.file_uploader("파일 업로드", type=['xlsx'])
     
     st.divider()
-    st.subheader("⚙️ 분석 기준")
-    target_irr_percent = st.number_input("목표 IRR (%)", value=6.15, format="%.2f", step=0.01)
-    tax_rate_percent = st.number_input("세율 (%)", value=20.9, format="%.1f", step=0.1)
-    period_input = st.number_input("상각 기간 (년)", value=30, step=1)
-    
-    st.subheader("💰 비용 단가 (2024년 기준)")
-    cost_maint_m_input = st.number_input("유지비 (원/m)", value=8222)
-    cost_admin_hh_input = st.number_input("관리비 (원/전)", value=6209)
-    cost_admin_m_input = st.number_input("관리비 (원/m)", value=13605)
+    # 분석 기준은 '적용'을 눌러야 반영 (입력 중 매번 재계산 방지)
+    with st.form("params"):
+        st.subheader("⚙️ 분석 기준")
+        target_irr_percent = st.number_input("목표 IRR (%)", value=6.15, format="%.2f", step=0.01)
+        tax_rate_percent = st.number_input("세율 (%)", value=20.9, format="%.1f", step=0.1)
+        period_input = st.number_input("상각 기간 (년)", value=30, step=1)
+
+        st.subheader("💰 비용 단가 (2024년 기준)")
+        cost_maint_m_input = st.number_input("유지비 (원/m)", value=8222)
+        cost_admin_hh_input = st.number_input("관리비 (원/전)", value=6209)
+        cost_admin_m_input = st.number_input("관리비 (원/m)", value=13605)
 
-    st.divider()
-    st.subheader("🔧 정밀 보정")
-    margin_override_input = st.number_input("단위당 마진 강제 (원/MJ)", value=0.0, step=0.0001, format="%.4f")
-    st.caption("* 0이면 자동 계산")
+        st.divider()
+        st.subheader("🔧 정밀 보정")
+        margin_override_input = st.number_input("단위당 마진 강제 (원/MJ)", value=0.0, step=0.0001, format="%.4f")
+        st.caption("* 0이면 자동 계산")
+        st.form_submit_button("적용")
 
     target_irr = target_irr_percent / 100
     tax_rate = tax_rate_percent / 100
@@ -166,24 +518,29 @@ c4.metric("적용 마진", f"{margin_override_input:.4f}" if margin_override_inp
 df = None
 if data_source == "GitHub 파일":
     if os.path.exists(DEFAULT_FILE_NAME):
-        df = pd.read_excel(DEFAULT_FILE_NAME, engine='openpyxl')
+        df = load_excel(DEFAULT_FILE_NAME, os.path.getmtime(DEFAULT_FILE_NAME))
     else:
         st.warning(f"⚠️ {DEFAULT_FILE_NAME} 없음")
 elif data_source == "엑셀 업로드" and uploaded_file:
-    df = pd.read_excel(uploaded_file, engine='openpyxl')
+    df = load_excel(uploaded_file.getvalue())
 
 if df is not None:
-    df = clean_column_names(df)
+    with st.spinner("계산 중…"):
+        result_df, arrays, msg = calculate_all_rows_cached(
+            df, target_irr, tax_rate, period_input,
+            cost_maint_m_input, cost_admin_hh_input, cost_admin_m_input,
+            margin_override_input
+        )
     
-    result_df, margins, msg = calculate_all_rows(
-        df, target_irr, tax_rate, period_input, 
-        cost_maint_m_input, cost_admin_hh_input, cost_admin_m_input,
-        margin_override_input
-    )
+    # 0으로 처리된 이상 행은 조용히 넘기지 않고 기록/표시
+    calc_warnings = result_df.attrs.get('calc_warnings', [])
     
     if msg:
         st.error(msg)
     else:
+        if calc_warnings:
+            with st.expander(f"⚠️ 계산 불가로 0 처리된 행 {len(calc_warnings)}건"):
+                st.write("\n".join(f"- {w}" for w in calc_warnings))
         # 1. 결과표
         st.divider()
         st.subheader("📊 분석 결과")
@@ -198,13 +555,13 @@ if df is not None:
             "적용마진(원/MJ)": ["적용마진"]
         }
         
-        final_df = pd.DataFrame()
-        for label, keywords in view_cols_map.items():
-            found = find_col(result_df, keywords)
-            if found:
-                final_df[label] = result_df[found]
+        # 표시 컬럼을 한 번에 골라 이름만 교체 (컬럼별 삽입 반복 없이)
+        # 결과표 / 산출 근거 / 그래프에서 쓸 컬럼을 한 번의 스캔으로 확정
+        page_cols = build_col_index(result_df, {**view_cols_map, **PAGE_COL_KEYWORDS})
+        resolved = {label: page_cols[label] for label in view_cols_map if page_cols[label]}
+        final_df = result_df[list(resolved.values())].set_axis(list(resolved), axis=1)
         
-        try:
+        if len(final_df) <= STYLER_MAX_ROWS:
             styler = final_df.style
             if "최소경제성만족판매량(MJ)" in final_df.columns:
                 styler = styler.background_gradient(subset=["최소경제성만족판매량(MJ)"], cmap="Oranges")
@@ -215,216 +572,92 @@ if df is not None:
                 "달성률": "{:.1f}%",
                 "적용마진(원/MJ)": "{:.4f}"
             }
-            valid_format = {k: v for k, v in format_dict.items() if k in final_df.columns}
+            # 원본이 문자열인 컬럼(예: 현재판매량)은 숫자 서식에서 제외 (예외로 표 전체를 다시 그리지 않도록)
+            valid_format = {
+                k: v for k, v in format_dict.items()
+                if k in final_df.columns and pd.api.types.is_numeric_dtype(final_df[k])
+            }
             styler = styler.format(valid_format)
 
             st.dataframe(styler, use_container_width=True, hide_index=True)
-        except:
-            st.dataframe(final_df, use_container_width=True)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            result_df.to_excel(writer, index=False)
-            writer.sheets['Sheet1'].set_column('A:Z', 18)
-        st.download_button("📥 엑셀 다운로드", output.getvalue(), "분석결과.xlsx", "primary")
+        else:
+            # 대용량: 셀별 Python 색상 계산 없이 브라우저에서 막대로 표시
+            # Styler 분기와 같은 서식 (천 단위 구분), 문자열 컬럼은 원본 그대로 표시
+            number_formats = {
+                "현재판매량(MJ)": "%,.0f",
+                "달성률": "%.1f%%",
+                "적용마진(원/MJ)": "%.4f",
+            }
+            column_config = {
+                k: st.column_config.NumberColumn(format=v) for k, v in number_formats.items()
+                if k in final_df.columns and pd.api.types.is_numeric_dtype(final_df[k])
+            }
+            if "최소경제성만족판매량(MJ)" in final_df.columns:
+                column_config["최소경제성만족판매량(MJ)"] = st.column_config.ProgressColumn(
+                    format="%,.1f", min_value=0,
+                    max_value=max(float(final_df["최소경제성만족판매량(MJ)"].max()), 1.0)
+                )
+            st.dataframe(final_df, column_config=column_config, use_container_width=True, hide_index=True)
+
+        # CSV는 항상 제공 (서식 불필요 시 엑셀보다 훨씬 빠름)
+        col_xlsx, col_csv = st.columns(2)
+        with col_xlsx:
+            st.download_button(
+                "📥 엑셀 다운로드", to_excel_bytes(result_df), "분석결과.xlsx",
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", type="primary"
+            )
+        with col_csv:
+            st.download_button("📥 CSV 다운로드", _to_csv(result_df), "분석결과.csv", "text/csv")
+        if len(result_df) > EXCEL_MAX_ROWS:
+            st.caption(f"* {EXCEL_MAX_ROWS:,}행 초과: CSV가 훨씬 빠릅니다")
 
         # 2. 개별 프로젝트 산출 근거 (위치 이동됨)
         st.divider()
         st.subheader("🧮 개별 프로젝트 산출 근거")
         
-        name_col = find_col(result_df, ["투자분석명", "공사명"])
+        name_col = page_cols["name"]
         if name_col:
-            selected = st.selectbox("프로젝트 선택:", result_df[name_col].unique())
-            row = result_df[result_df[name_col] == selected].iloc[0]
-            
-            # 데이터 추출 및 재계산 로직 (생략 없이 유지)
-            col_inv = find_col(result_df, ["배관투자"])
-            col_cont = find_col(result_df, ["분담금"])
-            col_vol = find_col(result_df, ["판매량계", "연간판매량"])
-            col_prof = find_col(result_df, ["판매수익"])
-            col_len = find_col(result_df, ["길이"])
-            col_hh = find_col(result_df, ["계획전수"])
-            col_use = find_col(result_df, ["용도"])
-
-            inv = parse_value(row.get(col_inv))
-            cont = parse_value(row.get(col_cont))
-            vol = parse_value(row.get(col_vol))
-            profit = parse_value(row.get(col_prof))
-            length = parse_value(row.get(col_len))
-            hh = parse_value(row.get(col_hh))
-            usage = str(row.get(col_use, ""))
-
-            pvifa = (1 - (1 + target_irr) ** (-period_input)) / target_irr
-            net_inv = inv - cont
-            req_capital = max(0, net_inv / pvifa)
-            
-            maint_c = length * cost_maint_m_input
-            if any(k in usage for k in ['공동', '단독', '주택', '아파트']):
-                admin_c = hh * cost_admin_hh_input
-                note = "주택용"
-            else:
-                admin_c = length * cost_admin_m_input
-                note = "비주택"
-            total_sga = maint_c + admin_c
-            
-            dep = inv / period_input
-            req_ebit = (req_capital - dep) / (1 - tax_rate)
-            req_gross = req_ebit + total_sga + dep
-            
-            auto_margin = profit / vol if vol > 0 else 0
-            if margin_override_input > 0:
-                final_margin = margin_override_input
-            else:
-                final_margin = auto_margin
-
-            final_vol = req_gross / final_margin if final_margin > 0 else 0
-
-            c1, c2 = st.columns(2)
-            with c1:
-                st.markdown("**1. 투자 정보**")
-                st.write(f"- 순투자액: **{net_inv:,.0f}** 원")
-                st.write(f"- 운영 비용: {total_sga:,.0f} 원")
-            with c2:
-                st.markdown("**2. 수익 구조**")
-                st.info(f"👉 **적용 마진:** {final_margin:.4f} 원/MJ")
-
-            st.markdown("---")
-            if final_vol > 0:
-                verify_margin = final_vol * final_margin
-                verify_ocf = (verify_margin - total_sga - dep) * (1 - tax_rate) + dep
-                verify_npv = (verify_ocf * pvifa) - net_inv
-                
-                st.write(f"**[최종 결과]** 목표 달성 최소 판매량: **{final_vol:,.1f} MJ**")
-                if abs(verify_npv) < 1000:
-                    st.success("✅ NPV ≈ 0 검증 완료")
-                else:
-                    st.warning("⚠️ 미세 오차 발생")
+            # 프로젝트명 → 첫 행 위치 (선택 시마다 전체 컬럼 비교 방지)
+            names = result_df[name_col].reset_index(drop=True)
+            first_names = names[~names.duplicated()]
+            row_index = dict(zip(first_names.tolist(), first_names.index))
+
+            render_project_detail(
+                row_index, arrays, target_irr, tax_rate, period_input,
+                cost_maint_m_input, cost_admin_hh_input, cost_admin_m_input,
+                margin_override_input
+            )
 
         # ==================================================================
         # 3. 그래프 섹션 (맨 하단)
         # ==================================================================
-        col_id = find_col(result_df, ["공사관리번호", "관리번호"])
+        col_id = page_cols["id"]
         chart_data_ready = False
         chart_df = pd.DataFrame()
 
         if col_id:
-            chart_df = result_df.copy()
-            chart_df['년도'] = chart_df[col_id].astype(str).str[:4]
-            chart_df = chart_df[chart_df['년도'].str.isnumeric()]
-            chart_df['년도'] = chart_df['년도'].astype(int)
-            chart_df = chart_df[(chart_df['년도'] >= 2020) & (chart_df['년도'] <= 2024)]
+            # 관리번호 앞 4자리 → 연도 (숫자 변환 한 번으로 필터까지 처리)
+            year = pd.to_numeric(result_df[col_id].astype(str).str.slice(0, 4), errors='coerce')
+            year_mask = year.between(CHART_YEARS[0], CHART_YEARS[-1])
+            # 그래프에 필요한 컬럼만 잘라냄 (결과표 전체 복사 방지)
+            col_use = page_cols["usage"]
+            chart_cols = ['최소경제성만족판매량'] + ([col_use] if col_use else [])
+            chart_df = result_df.loc[year_mask, chart_cols].assign(년도=year[year_mask].astype('int16'))
             if not chart_df.empty:
                 chart_data_ready = True
 
         if chart_data_ready:
-            st.divider()
-            st.header("📉 경제성 분석 리포트 (Visual Analytics)")
-            
-            # 3-1. 연도별 분석 리포트
-            st.subheader("1. 연도별 최소 판매량 추이 (Annual)")
-            
-            tab1, tab2 = st.tabs(["📊 전체 추이 (막대)", "📈 용도별 상세 (선형)"])
-            
-            # Tab 1: 전체
-            with tab1:
-                total_by_year = chart_df.groupby('년도')['최소경제성만족판매량'].sum()
-                st.bar_chart(total_by_year, color="#FF6C6C")
-                
-                display_df = pd.DataFrame(total_by_year).reset_index()
-                display_df.columns = ['Year', 'Total Volume (MJ)']
-                st.dataframe(display_df.style.format({"Total Volume (MJ)": "{:,.0f}"}), hide_index=True)
-                
-                # [추가] 다운로드 버튼 (CSV)
-                csv = display_df.to_csv(index=False).encode('utf-8-sig')
-                st.download_button("📥 데이터 다운로드 (CSV)", csv, "annual_total.csv", "text/csv")
-            
-            # Tab 2: 용도별
-            with tab2:
-                col_use = find_col(chart_df, ["용도", "구분"])
-                if col_use:
-                    usage_list = sorted(chart_df[col_use].unique().tolist())
-                    usage_list.insert(0, "전체 합계 (Total)")
-                    
-                    selected_usage = st.selectbox("분석할 용도 선택:", usage_list, key="annual_usage")
-                    
-                    full_idx = range(2020, 2025)
-                    
-                    if selected_usage == "전체 합계 (Total)":
-                        usage_by_year = chart_df.groupby('년도')['최소경제성만족판매량'].sum()
-                        chart_color = "#FF4B4B"
-                    else:
-                        filtered_df = chart_df[chart_df[col_use] == selected_usage]
-                        usage_by_year = filtered_df.groupby('년도')['최소경제성만족판매량'].sum()
-                        chart_color = "#FFA500"
-                    
-                    usage_by_year = usage_by_year.reindex(full_idx, fill_value=0)
-                    st.line_chart(usage_by_year, color=chart_color)
-                    
-                    display_df = pd.DataFrame(usage_by_year).reset_index()
-                    display_df.columns = ['Year', 'Volume (MJ)']
-                    st.dataframe(display_df.style.format({"Volume (MJ)": "{:,.0f}"}), hide_index=True)
-                    
-                    # [추가] 다운로드 버튼 (CSV)
-                    csv_usg = display_df.to_csv(index=False).encode('utf-8-sig')
-                    st.download_button(f"📥 {selected_usage} 데이터 다운로드 (CSV)", csv_usg, f"annual_{selected_usage}.csv", "text/csv")
-                else:
-                    st.warning("용도 컬럼 없음")
-
-            # 3-2. 누적 분석 리포트
-            st.divider()
-            st.subheader("2. 연도별 누적 최소 판매량 (Cumulative)")
-            
-            tab_cum1, tab_cum2 = st.tabs(["📊 전체 누적 (막대)", "📈 용도별 누적 (선형)"])
-            
-            # Tab 1: 전체 누적
-            with tab_cum1:
-                annual_sum = chart_df.groupby('년도')['최소경제성만족판매량'].sum().sort_index()
-                full_idx = range(2020, 2025)
-                annual_sum = annual_sum.reindex(full_idx, fill_value=0)
-                cumulative_sum = annual_sum.cumsum()
-                
-                st.bar_chart(cumulative_sum, color="#4CAF50")
-                
-                cum_df = pd.DataFrame({
-                    "연도": cumulative_sum.index,
-                    "누적 판매량 (MJ)": cumulative_sum.values
-                })
-                st.dataframe(cum_df.style.format({"누적 판매량 (MJ)": "{:,.0f}"}), hide_index=True)
-                
-                # [추가] 다운로드 버튼
-                csv_cum = cum_df.to_csv(index=False).encode('utf-8-sig')
-                st.download_button("📥 누적 데이터 다운로드 (CSV)", csv_cum, "cumulative_total.csv", "text/csv")
-
-            # Tab 2: 용도별 누적
-            with tab_cum2:
-                col_use = find_col(chart_df, ["용도", "구분"])
-                if col_use:
-                    usage_list_cum = sorted(chart_df[col_use].unique().tolist())
-                    usage_list_cum.insert(0, "전체 합계 (Total)")
-                    
-                    selected_usage_cum = st.selectbox("누적 분석할 용도 선택:", usage_list_cum, key="cum_usage")
-                    
-                    if selected_usage_cum == "전체 합계 (Total)":
-                        annual_data = chart_df.groupby('년도')['최소경제성만족판매량'].sum()
-                        chart_color_cum = "#2E7D32" 
-                    else:
-                        filtered_df_cum = chart_df[chart_df[col_use] == selected_usage_cum]
-                        annual_data = filtered_df_cum.groupby('년도')['최소경제성만족판매량'].sum()
-                        chart_color_cum = "#009688"
-                    
-                    annual_data = annual_data.reindex(full_idx, fill_value=0)
-                    cumulative_data = annual_data.cumsum()
-                    
-                    st.line_chart(cumulative_data, color=chart_color_cum)
-                    
-                    cum_disp_df = pd.DataFrame(cumulative_data).reset_index()
-                    cum_disp_df.columns = ['Year', 'Cumulative Volume (MJ)']
-                    st.dataframe(cum_disp_df.style.format({"Cumulative Volume (MJ)": "{:,.0f}"}), hide_index=True)
-                    
-                    # [추가] 다운로드 버튼
-                    csv_cum_usg = cum_disp_df.to_csv(index=False).encode('utf-8-sig')
-                    st.download_button(f"📥 {selected_usage_cum} 누적 데이터 다운로드 (CSV)", csv_cum_usg, f"cumulative_{selected_usage_cum}.csv", "text/csv")
-
+            # 집계는 전체 재실행 때 한 번만 (fragment 재실행 시에는 표를 잘라 쓰기만 함)
+            render_charts(annual_volume_pivot(chart_df, col_use), col_use is not None)
         elif not chart_data_ready:
             st.divider()
             st.info("⚠️ 2020~2024년 데이터가 없어 그래프를 그릴 수 없습니다.")
+
+        # ==================================================================
+        # 4. 민감도 분석
+        # ==================================================================
+        render_sensitivity(
+            arrays, target_irr, tax_rate, period_input,
+            cost_maint_m_input, cost_admin_hh_input, cost_admin_m_input,
+            margin_override_input
+        )